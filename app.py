@@ -1,10 +1,112 @@
-from flask import Flask, render_template
+import os
+import hmac
+import time
+import hashlib
+from flask import Flask, render_template, jsonify, request, abort, redirect, url_for, session
+
+import botstate
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+DRAIN_DEADLINE = int(os.getenv("DRAIN_DEADLINE", 1800))
 
 app = Flask(__name__)
+# Signs the admin session cookie; derived from the token, so changing ADMIN_TOKEN logs every browser out
+app.secret_key = hashlib.sha256(b"media-bot-admin-session:" + ADMIN_TOKEN.encode()).digest()
+app.config.update(SESSION_COOKIE_HTTPONLY=True, SESSION_COOKIE_SAMESITE="Strict")
+
+@app.template_filter("filesize")
+def filesize(size):
+    size = float(size or 0)
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} TB"
+
+def token_ok(token: str) -> bool:
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def is_admin() -> bool:
+    """
+    API clients send the token in the X-Admin-Token header; browsers exchange it once at
+    /admin/login for a session cookie. It never travels in a URL.
+    """
+    return token_ok(request.headers.get("X-Admin-Token", "")) or (bool(ADMIN_TOKEN) and session.get("admin") is True)
+
+def require_admin():
+    if not is_admin():
+        abort(403)
+
+def done(**payload):
+    """Browsers (session) go back to the dashboard, API clients (header) get JSON."""
+    if "X-Admin-Token" in request.headers:
+        return jsonify(**payload)
+    return redirect(url_for("admin"))
 
 @app.route("/")
 def home():
     return 'hello s2'
 
+@app.route("/healthz")
+def healthz():
+    """Liveness of the web process itself."""
+    return jsonify(ok=True)
+
+@app.route("/readyz")
+def readyz():
+    """Ready while the bot is heartbeating and not draining."""
+    alive = botstate.is_alive()
+    draining = botstate.drain_request() is not None
+    ready = alive and not draining
+    return jsonify(ready=ready, bot_alive=alive, draining=draining), 200 if ready else 503
+
+@app.route("/api/status")
+def api_status():
+    require_admin()
+    return jsonify(botstate.status())
+
+@app.route("/admin")
+def admin():
+    if not is_admin():
+        return render_template("login.html", error=None), 401
+    return render_template(
+        "dashboard.html",
+        status=botstate.status(),
+        now=time.time(),
+        drain_deadline=DRAIN_DEADLINE,
+    )
+
+@app.route("/admin/login", methods=["POST"])
+def login():
+    if not token_ok(request.form.get("token", "")):
+        return render_template("login.html", error="Wrong token."), 403
+    session["admin"] = True
+    return redirect(url_for("admin"))
+
+@app.route("/admin/logout", methods=["POST"])
+def logout():
+    session.clear()
+    return redirect(url_for("admin"))
+
+@app.route("/admin/drain", methods=["POST"])
+def drain():
+    """Stops the bot taking new jobs; it restarts once running jobs finish or the deadline passes."""
+    require_admin()
+    try:
+        deadline = int(request.values.get("deadline", DRAIN_DEADLINE))
+    except ValueError:
+        deadline = -1
+    if deadline < 0:
+        return jsonify(error="deadline must be a whole number of seconds, 0 or more"), 400
+    botstate.request_drain(deadline)
+    return done(draining=botstate.drain_request())
+
+@app.route("/admin/drain/cancel", methods=["POST"])
+def cancel_drain():
+    require_admin()
+    botstate.cancel_drain()
+    return done(draining=None)
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,624 @@
+"""
+Load-testing harness for the media bot.
+
+Drives the real handlers in t.py (main_handler, callbacks, res_select,
+format_callbacks, inputs, done_merge, photo_handler) through a local stand-in for Pyrogram's
+download/upload/send APIs. Transfers are throttled through a shared link with
+configurable bandwidth and per-call latency, and the media comes from a
+synthetic corpus rendered with ffmpeg's `testsrc`.
+
+For every scenario it reports jobs per minute, per-stage latency percentiles
+(including time queued for a job slot, so --max-jobs runs can be compared),
+peak RSS of the process tree (bot + ffmpeg children) and peak disk usage of
+the work directory. Use --json to save a run and --baseline to diff against a
+previous one, so performance changes can be compared commit to commit.
+
+Usage:
+    python bench.py --jobs 12 --concurrency 4 --bandwidth 20 --latency 80
+    python bench.py --scenarios split,merge --json bench_output.json
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import asyncio
+import pathlib
+import random
+import argparse
+import itertools
+import contextlib
+import contextvars
+import subprocess
+import hashlib
+import tempfile
+
+import psutil
+
+import t
+import botstate
+
+# ---------------- CONFIGURATION ----------------
+
+DEFAULT_CORPUS = "640x360:10,1280x720:20"
+DEFAULT_SCENARIOS = "split,audio,gif,res,rename,ss,thumb,compress,merge"
+STAGES = ("download", "queue", "process", "upload", "api", "total")
+THUMB_NAME = "thumb_320x180.jpg"
+SAMPLE_INTERVAL = 0.05
+HASH_RANGE = 128 * 1024 # Bytes per upload.getFileHashes range
+HASH_BATCH = 10 # Ranges per getFileHashes answer
+BASE_UID = 900000000
+
+CURRENT_JOB = contextvars.ContextVar("CURRENT_JOB", default=None)
+
+# ---------------- CORPUS ----------------
+
+def generate_corpus(spec: str, corpus_dir: pathlib.Path, regen: bool = False):
+    """Renders one testsrc clip per `WxH:seconds` entry and returns their paths."""
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for entry in spec.split(","):
+        size, duration = entry.strip().split(":")
+        path = corpus_dir / f"testsrc_{size}_{duration}s.mp4"
+        if regen or not path.exists():
+            cmd = [
+                "ffmpeg", "-y", "-v", "error",
+                "-f", "lavfi", "-i", f"testsrc=duration={duration}:size={size}:rate=30",
+                "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+                "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-b:a", "128k", "-shortest",
+                str(path)
+            ]
+            subprocess.run(cmd, check=True)
+        paths.append(path)
+
+    thumb = corpus_dir / THUMB_NAME # The photo sent by the thumb scenario
+    if regen or not thumb.exists():
+        cmd = [
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "lavfi", "-i", "testsrc=size=320x180", "-frames:v", "1", str(thumb)
+        ]
+        subprocess.run(cmd, check=True)
+    return paths
+
+# ---------------- FAKE TELEGRAM ----------------
+
+class FakeLink:
+    """A single shared uplink/downlink with fixed bandwidth and per-call latency."""
+
+    def __init__(self, bandwidth: float, latency: float):
+        self.bandwidth = bandwidth # bytes per second, 0 = unlimited
+        self.latency = latency # seconds per API round trip
+        self._next_free = 0.0
+
+    async def rtt(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def transfer(self, nbytes: int):
+        """Reserves the next free slot on the link so concurrent transfers share bandwidth."""
+        if not self.bandwidth:
+            return
+        now = time.perf_counter()
+        start = max(now, self._next_free)
+        self._next_free = start + nbytes / self.bandwidth
+        await asyncio.sleep(self._next_free - now)
+
+
+class JobRecord:
+    def __init__(self, scenario: str, uid: int):
+        self.scenario = scenario
+        self.uid = uid
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.uploads = 0
+        self.drops = 0
+        self.corrupted = 0
+        self.errors = []
+
+    @property
+    def ok(self):
+        return self.uploads > 0 and not self.errors
+
+
+@contextlib.contextmanager
+def timed(stage: str):
+    """Adds the elapsed time of the block to the current job's stage counter."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        job = CURRENT_JOB.get()
+        if job is not None:
+            job.stages[stage] += time.perf_counter() - started
+
+
+class Obj:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class FakeMessage:
+    """Implements the subset of pyrogram.types.Message that t.py touches."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, client, uid: int, text: str = None, media_path: pathlib.Path = None,
+                 photo_path: pathlib.Path = None, reply_to_message=None):
+        self._client = client
+        self.id = next(self._ids)
+        self.from_user = Obj(id=uid)
+        self.chat = Obj(id=uid)
+        self.text = text
+        self.reply_to_message = reply_to_message
+        self.photo = None
+        self.audio = None
+        self.document = None
+        self.video = None
+        if media_path is not None:
+            self.video = Obj(
+                file_id=str(media_path),
+                file_name=media_path.name,
+                file_size=media_path.stat().st_size,
+                mime_type="video/mp4"
+            )
+        if photo_path is not None:
+            self.photo = Obj(file_id=str(photo_path), file_size=photo_path.stat().st_size)
+
+    # --- transfers ---
+    async def download(self, file_name: str = "", *args, progress=None, **kwargs):
+        return await self._client.download_media(self, file_name, progress=progress)
+
+    async def reply_video(self, video, *args, **kwargs):
+        return await self._client.send_video(self.chat.id, video, **kwargs)
+
+    async def reply_photo(self, photo, *args, **kwargs):
+        return await self._client.send_photo(self.chat.id, photo, **kwargs)
+
+    # --- plain API calls ---
+    async def reply_text(self, text, *args, **kwargs):
+        with timed("api"):
+            await self._client.link.rtt()
+        self._client.check_text(text)
+        return FakeMessage(self._client, self.from_user.id, text=text, reply_to_message=self)
+
+    async def edit_text(self, text, *args, **kwargs):
+        with timed("api"):
+            await self._client.link.rtt()
+        self._client.check_text(text)
+        self.text = text
+        return self
+
+    edit = edit_text
+
+    async def delete(self, *args, **kwargs):
+        with timed("api"):
+            await self._client.link.rtt()
+        return True
+
+
+class FakeCallbackQuery:
+    def __init__(self, client, uid: int, data: str, message: FakeMessage):
+        self._client = client
+        self.from_user = Obj(id=uid)
+        self.data = data
+        self.message = message
+
+    async def answer(self, *args, **kwargs):
+        with timed("api"):
+            await self._client.link.rtt()
+        return True
+
+
+class FakeClient:
+    """Stand-in for pyrogram.Client: moves bytes through a FakeLink instead of Telegram."""
+
+    def __init__(self, link: FakeLink, drop_rate: float = 0.0, corrupt_rate: float = 0.0):
+        self.link = link
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+
+    def check_text(self, text: str):
+        job = CURRENT_JOB.get()
+        if job is not None and (text.startswith("❌") or text.startswith("Error")):
+            job.errors.append(text)
+
+    async def download_media(self, message: FakeMessage, file_name: str, progress=None):
+        """Copies the source file in CHUNK_SIZE pieces, paying for each one on the link."""
+        with timed("download"):
+            await self.link.rtt()
+            media = message.video or message.photo
+            src = media.file_id
+            total = media.file_size
+            pathlib.Path(file_name).parent.mkdir(parents=True, exist_ok=True)
+            with open(src, "rb") as fin, open(file_name, "wb") as fout:
+                while chunk := fin.read(t.CHUNK_SIZE):
+                    await self.link.transfer(len(chunk))
+                    fout.write(chunk)
+                    if progress:
+                        await progress(fout.tell(), total)
+        return file_name
+
+    async def stream_media(self, message: FakeMessage, limit: int = 0, offset: int = 0):
+        """
+        Yields the source in STREAM_CHUNK pieces from chunk `offset`, dropping the connection at
+        --drop-rate and flipping a byte of the chunk at --corrupt-rate.
+        """
+        job = CURRENT_JOB.get()
+        with timed("download"):
+            await self.link.rtt()
+        with open(message.video.file_id, "rb") as fin:
+            fin.seek(offset * t.STREAM_CHUNK)
+            sent = 0
+            while chunk := fin.read(t.STREAM_CHUNK):
+                with timed("download"):
+                    await self.link.transfer(len(chunk))
+                if self.drop_rate and random.random() < self.drop_rate:
+                    if job is not None:
+                        job.drops += 1
+                    raise ConnectionError("injected connection drop")
+                if self.corrupt_rate and random.random() < self.corrupt_rate:
+                    if job is not None:
+                        job.corrupted += 1
+                    chunk = bytes([chunk[0] ^ 0xFF]) + chunk[1:]
+                yield chunk
+                sent += 1
+                if limit and sent >= limit:
+                    return
+
+    async def file_hashes(self, message: FakeMessage, offset: int):
+        """Stand-in for upload.getFileHashes: SHA-256 of HASH_BATCH ranges from offset on."""
+        with timed("download"):
+            await self.link.rtt()
+        hashes = []
+        with open(message.video.file_id, "rb") as fin:
+            fin.seek(offset)
+            while len(hashes) < HASH_BATCH and (data := fin.read(HASH_RANGE)):
+                hashes.append((offset, HASH_RANGE, hashlib.sha256(data).digest()))
+                offset += HASH_RANGE
+        return hashes
+
+    async def _upload(self, path, progress=None):
+        with timed("upload"):
+            await self.link.rtt()
+            size = os.path.getsize(path)
+            for offset in range(0, size, t.CHUNK_SIZE):
+                await self.link.transfer(min(t.CHUNK_SIZE, size - offset))
+                if progress:
+                    await progress(min(offset + t.CHUNK_SIZE, size), size)
+        job = CURRENT_JOB.get()
+        if job is not None:
+            job.uploads += 1
+        return FakeMessage(self, job.uid if job else 0)
+
+    async def send_document(self, chat_id, document, *args, progress=None, **kwargs):
+        return await self._upload(document, progress)
+
+    async def send_video(self, chat_id, video, *args, progress=None, **kwargs):
+        return await self._upload(video, progress)
+
+    async def send_audio(self, chat_id, audio, *args, progress=None, **kwargs):
+        return await self._upload(audio, progress)
+
+    async def send_animation(self, chat_id, animation, *args, progress=None, **kwargs):
+        return await self._upload(animation, progress)
+
+    async def send_photo(self, chat_id, photo, *args, progress=None, **kwargs):
+        return await self._upload(photo, progress)
+
+# ---------------- SCENARIOS ----------------
+
+async def open_menu(c: FakeClient, uid: int, source: pathlib.Path):
+    """Sends a file to main_handler and returns the menu message it replied with."""
+    m = FakeMessage(c, uid, media_path=source)
+    menu = None
+    original = m.reply_text
+
+    async def capture(text, *args, **kwargs):
+        nonlocal menu
+        menu = await original(text, *args, **kwargs)
+        return menu
+
+    m.reply_text = capture
+    await t.main_handler(c, m)
+    return menu
+
+
+async def press(c: FakeClient, uid: int, data: str, menu: FakeMessage, handler=None):
+    await (handler or t.callbacks)(c, FakeCallbackQuery(c, uid, data, menu))
+
+
+async def scenario_action(act: str, c, uid, sources):
+    menu = await open_menu(c, uid, sources[0])
+    await press(c, uid, f"act:{act}", menu)
+
+
+async def scenario_res(c, uid, sources):
+    menu = await open_menu(c, uid, sources[0])
+    await press(c, uid, "act:res", menu)
+    await press(c, uid, "res:240", menu, t.res_select)
+    await press(c, uid, f"format:document:{uid}", menu, t.format_callbacks)
+
+
+async def scenario_rename(c, uid, sources):
+    menu = await open_menu(c, uid, sources[0])
+    await press(c, uid, "act:rename", menu)
+    await t.inputs(c, FakeMessage(c, uid, text=f"renamed_{uid}.mp4"))
+    await press(c, uid, f"format:video:{uid}", menu, t.format_callbacks)
+
+
+async def scenario_ss(c, uid, sources):
+    menu = await open_menu(c, uid, sources[0])
+    await press(c, uid, "act:ss", menu)
+    await t.inputs(c, FakeMessage(c, uid, text="00:00:01"))
+
+
+async def scenario_thumb(c, uid, sources):
+    menu = await open_menu(c, uid, sources[0])
+    await press(c, uid, "act:thumb", menu)
+    await t.photo_handler(c, FakeMessage(c, uid, photo_path=sources[0].parent / THUMB_NAME))
+
+
+async def scenario_compress(c, uid, sources):
+    menu = await open_menu(c, uid, sources[0])
+    await press(c, uid, "act:compress", menu)
+    await press(c, uid, "act:cmp_custom", menu)
+    # Half the source size, so the encode path always runs
+    target_mb = sources[0].stat().st_size / 2 / 1024 / 1024
+    await t.inputs(c, FakeMessage(c, uid, text=f"{target_mb:.3f}"))
+    await press(c, uid, f"format:document:{uid}", menu, t.format_callbacks)
+
+
+async def scenario_merge(c, uid, sources):
+    menu = await open_menu(c, uid, sources[0])
+    await press(c, uid, "act:merge_start", menu)
+    for _ in range(2):
+        await t.main_handler(c, FakeMessage(c, uid, media_path=sources[0]))
+    await t.done_merge(c, FakeMessage(c, uid, text="/done"))
+
+
+SCENARIOS = {
+    "split": lambda c, uid, src: scenario_action("split", c, uid, src),
+    "audio": lambda c, uid, src: scenario_action("audio", c, uid, src),
+    "gif": lambda c, uid, src: scenario_action("gif", c, uid, src),
+    "res": scenario_res,
+    "rename": scenario_rename,
+    "ss": scenario_ss,
+    "thumb": scenario_thumb,
+    "compress": scenario_compress,
+    "merge": scenario_merge,
+}
+
+# ---------------- MEASUREMENT ----------------
+
+def dir_size(path: pathlib.Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(OSError):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class Sampler:
+    """Polls RSS of this process plus its children, and the size of the work directory."""
+
+    def __init__(self, workdir: pathlib.Path):
+        self.workdir = workdir
+        self.proc = psutil.Process()
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._task = None
+
+    def sample(self):
+        rss = 0
+        for p in [self.proc] + self.proc.children(recursive=True):
+            with contextlib.suppress(psutil.Error):
+                rss += p.memory_info().rss
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_disk = max(self.peak_disk, dir_size(self.workdir))
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+        self.sample()
+
+
+def queue_timed(track_job):
+    """Wraps t.track_job to add the time a job waits for its slots to the current job's queue stage."""
+    @contextlib.asynccontextmanager
+    async def wrapper(*args, **kwargs):
+        job = CURRENT_JOB.get()
+        api_before = job.stages["api"] if job else 0.0
+        started = time.perf_counter()
+        async with track_job(*args, **kwargs) as bot_job:
+            if job is not None:
+                # The "Queued" status edit is already counted as api time
+                job.stages["queue"] += time.perf_counter() - started - (job.stages["api"] - api_before)
+            yield bot_job
+    return wrapper
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+async def run_job(name: str, c: FakeClient, uid: int, sources: list) -> JobRecord:
+    job = JobRecord(name, uid)
+    token = CURRENT_JOB.set(job)
+    started = time.perf_counter()
+    try:
+        await SCENARIOS[name](c, uid, sources)
+    except Exception as e:
+        job.errors.append(repr(e))
+    finally:
+        job.stages["total"] = time.perf_counter() - started
+        waits = sum(job.stages[s] for s in ("download", "queue", "upload", "api"))
+        job.stages["process"] = max(0.0, job.stages["total"] - waits)
+        CURRENT_JOB.reset(token)
+        t.USER_STATE.pop(uid, None)
+    return job
+
+
+async def run_scenario(name: str, args, sources: list, uids) -> dict:
+    c = FakeClient(FakeLink(args.bandwidth * 1024 * 1024, args.latency / 1000), args.drop_rate, args.corrupt_rate)
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def worker(i):
+        async with sem:
+            src = sources[i % len(sources):] + sources[:i % len(sources)]
+            return await run_job(name, c, next(uids), src)
+
+    with Sampler(t.WORKDIR) as sampler:
+        started = time.perf_counter()
+        jobs = await asyncio.gather(*(worker(i) for i in range(args.jobs)))
+        wall = time.perf_counter() - started
+
+    ok = [j for j in jobs if j.ok]
+    result = {
+        "jobs": len(jobs),
+        "ok": len(ok),
+        "failed": len(jobs) - len(ok),
+        "wall_s": round(wall, 3),
+        "jobs_per_min": round(len(ok) / wall * 60, 2) if wall else 0.0,
+        "peak_rss_mb": round(sampler.peak_rss / 1024 / 1024, 1),
+        "peak_disk_mb": round(sampler.peak_disk / 1024 / 1024, 1),
+        "dropped_chunks": sum(j.drops for j in jobs),
+        "corrupted_chunks": sum(j.corrupted for j in jobs),
+        "stages": {},
+        "errors": sorted({e for j in jobs for e in j.errors})[:5],
+    }
+    for stage in STAGES:
+        values = [j.stages[stage] for j in ok]
+        result["stages"][stage] = {
+            f"p{p}": round(percentile(values, p), 3) for p in (50, 90, 99)
+        }
+    return result
+
+# ---------------- REPORTING ----------------
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"\n📊 Bench @ {report['revision']}  "
+          f"(bandwidth {report['config']['bandwidth']} MB/s, latency {report['config']['latency']} ms, "
+          f"concurrency {report['config']['concurrency']})\n")
+    for name, res in report["scenarios"].items():
+        line = (f"{name:<8} {res['ok']}/{res['jobs']} ok  {res['jobs_per_min']:>7.2f} jobs/min  "
+                f"RSS {res['peak_rss_mb']:>7.1f} MB  disk {res['peak_disk_mb']:>7.1f} MB")
+        if res.get("dropped_chunks"):
+            line += f"  {res['dropped_chunks']} drops"
+        if res.get("corrupted_chunks"):
+            line += f"  {res['corrupted_chunks']} corrupted"
+        old = (baseline or {}).get("scenarios", {}).get(name)
+        if old and old.get("jobs_per_min"):
+            delta = (res["jobs_per_min"] - old["jobs_per_min"]) / old["jobs_per_min"] * 100
+            line += f"  ({delta:+.1f}% vs {baseline.get('revision', 'baseline')})"
+        print(line)
+        for stage in STAGES:
+            s = res["stages"][stage]
+            print(f"    {stage:<9} p50 {s['p50']:>8.3f}s  p90 {s['p90']:>8.3f}s  p99 {s['p99']:>8.3f}s")
+        for err in res["errors"]:
+            print(f"    ⚠️ {err[:120]}")
+
+
+@contextlib.contextmanager
+def silenced_stderr(enabled: bool):
+    """ffmpeg writes progress to the inherited stderr; hide it so the report stays readable."""
+    if not enabled:
+        yield
+        return
+    sys.stderr.flush()
+    saved = os.dup(2)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 2)
+    try:
+        yield
+    finally:
+        os.dup2(saved, 2)
+        os.close(saved)
+
+
+async def main(args):
+    bench_dir = pathlib.Path(args.dir)
+    sources = generate_corpus(args.corpus, bench_dir / "corpus", args.regen)
+
+    t.WORKDIR = bench_dir / "work"
+    t.SPLIT_SIZE_BYTES = args.split_mb * 1024 * 1024
+    t.JOB_SLOTS = t.JobSlots(args.max_jobs)
+    t.track_job = queue_timed(t.track_job)
+    t.fetch_file_hashes = lambda c, msg, offset: c.file_hashes(msg, offset)
+    botstate.STATE_DB = str(bench_dir / "bot_state.db")
+    botstate.reset()
+    uids = itertools.count(BASE_UID)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": int(time.time()),
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline", "dir")},
+        "scenarios": {},
+    }
+    with silenced_stderr(not args.verbose):
+        for name in args.scenarios.split(","):
+            if t.WORKDIR.exists():
+                shutil.rmtree(t.WORKDIR)
+            t.WORKDIR.mkdir(parents=True)
+            report["scenarios"][name] = await run_scenario(name, args, sources, uids)
+    shutil.rmtree(t.WORKDIR, ignore_errors=True)
+    return report
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Load-test the media bot handlers against a fake Telegram.")
+    p.add_argument("--scenarios", default=DEFAULT_SCENARIOS, help=f"comma list from: {', '.join(SCENARIOS)}")
+    p.add_argument("--jobs", type=int, default=8, help="jobs per scenario")
+    p.add_argument("--concurrency", type=int, default=4, help="jobs in flight at once")
+    p.add_argument("--max-jobs", type=int, default=t.MAX_JOBS, help="bot-side job slots (MAX_JOBS)")
+    p.add_argument("--bandwidth", type=float, default=20.0, help="shared link bandwidth in MB/s (0 = unlimited)")
+    p.add_argument("--latency", type=float, default=50.0, help="API round-trip latency in ms")
+    p.add_argument("--drop-rate", type=float, default=0.0, help="probability a streamed chunk drops the connection")
+    p.add_argument("--corrupt-rate", type=float, default=0.0, help="probability a streamed chunk arrives with a flipped byte")
+    p.add_argument("--corpus", default=DEFAULT_CORPUS, help="comma list of WxH:seconds testsrc clips")
+    p.add_argument("--split-mb", type=int, default=2, help="split threshold used for the split scenario")
+    p.add_argument("--dir", default=os.path.join(tempfile.gettempdir(), "media_bot_bench"),
+                   help="where the corpus and work directory live")
+    p.add_argument("--regen", action="store_true", help="re-render the corpus")
+    p.add_argument("--json", help="write the report to this file")
+    p.add_argument("--baseline", help="previous --json report to compare against")
+    p.add_argument("--verbose", action="store_true", help="keep ffmpeg/bot stderr output")
+    args = p.parse_args(argv)
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        p.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
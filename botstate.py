@@ -0,0 +1,138 @@
+"""
+State shared between the bot (t.py) and the ops app (app.py).
+
+Both processes open the same SQLite file. Every few seconds the bot publishes
+its jobs together with a heartbeat snapshot (from a worker thread, never from
+its event loop); app.py reads them and writes control flags (such as a drain
+request) that the bot polls.
+"""
+import os
+import json
+import time
+import sqlite3
+import contextlib
+
+STATE_DB = os.getenv("STATE_DB", "bot_state.db")
+HEARTBEAT_STALE = 15 # Seconds without a heartbeat before the bot counts as not ready
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    reserved_bytes INTEGER NOT NULL DEFAULT 0,
+    started REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_initialized = set()
+
+
+@contextlib.contextmanager
+def _db():
+    conn = sqlite3.connect(STATE_DB, timeout=5, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        if STATE_DB not in _initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            _initialized.add(STATE_DB)
+        yield conn
+    finally:
+        conn.close()
+
+# ---------------- KEY/VALUE ----------------
+
+def set_value(key: str, value):
+    with _db() as conn:
+        conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+
+def get_value(key: str, default=None):
+    with _db() as conn:
+        row = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+    return json.loads(row["value"]) if row else default
+
+
+def delete_value(key: str):
+    with _db() as conn:
+        conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+# ---------------- JOBS ----------------
+
+def reset():
+    """Called by the bot on startup: jobs and drain requests from a previous process are stale."""
+    with _db() as conn:
+        conn.execute("DELETE FROM jobs")
+        conn.execute("DELETE FROM kv WHERE key = 'drain'")
+
+
+def publish(snapshot: dict, jobs: list):
+    """Replaces the job table and writes the heartbeat in one transaction, so readers never see them disagree."""
+    with _db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM jobs")
+            conn.executemany(
+                "INSERT INTO jobs (id, uid, action, stage, progress, reserved_bytes, started, updated) "
+                "VALUES (:id, :uid, :action, :stage, :progress, :reserved_bytes, :started, :updated)",
+                jobs
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value) VALUES ('heartbeat', ?)",
+                (json.dumps({**snapshot, "ts": time.time()}),)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def list_jobs() -> list:
+    with _db() as conn:
+        rows = conn.execute("SELECT * FROM jobs ORDER BY started").fetchall()
+    return [dict(r) for r in rows]
+
+# ---------------- HEARTBEAT & DRAIN ----------------
+
+def read_heartbeat() -> dict:
+    return get_value("heartbeat", {})
+
+
+def is_alive() -> bool:
+    return time.time() - read_heartbeat().get("ts", 0) < HEARTBEAT_STALE
+
+
+def request_drain(deadline_seconds: int):
+    """Asks the bot to stop taking new jobs and exit once running ones finish (or the deadline passes)."""
+    now = time.time()
+    set_value("drain", {"requested": now, "deadline": now + deadline_seconds})
+
+
+def cancel_drain():
+    delete_value("drain")
+
+
+def drain_request() -> dict:
+    return get_value("drain")
+
+
+def status() -> dict:
+    """Everything the ops app shows, in one read."""
+    jobs = list_jobs()
+    return {
+        "alive": is_alive(),
+        "draining": drain_request(),
+        "heartbeat": read_heartbeat(),
+        "queue_depth": sum(1 for j in jobs if j["stage"] == "queued"),
+        "running": [j for j in jobs if j["stage"] != "queued"],
+        "queued": [j for j in jobs if j["stage"] == "queued"],
+        "reserved_bytes": sum(j["reserved_bytes"] for j in jobs),
+    }
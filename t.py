@@ -7,9 +7,17 @@ import shutil
 import pathlib
 import json
 import glob
-from pyrogram import Client, filters
+import heapq
+import itertools
+import functools
+import contextlib
+import hashlib
+from pyrogram import Client, filters, idle, raw
+from pyrogram.file_id import FileId
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ForceReply
 
+import botstate
+
 # ---------------- CONFIGURATION ----------------
 # I have inserted your credentials here as defaults.
 API_ID = int(os.getenv("API_ID", 27972068))
@@ -19,16 +27,49 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "7027917459:AAG2jKW2hqkYaJj2Zuhw5bcTXNYhpDotG
 # --- ADMIN CONFIGURATION ---
 # IMPORTANT: Replace 123456789 with your actual Telegram User ID (numeric)
 OWNER_ID = int(os.getenv("OWNER_ID", 6075512585)) 
+# Comma-separated user IDs that share the owner's priority lane and get larger rate limits
+PREMIUM_USERS = {int(u) for u in os.getenv("PREMIUM_USERS", "").split(",") if u.strip()}
 # ---------------------------------------------
 
 # Tuning
 CHUNK_SIZE = 512 * 1024 
 SPLIT_SIZE_BYTES = 1900 * 1024 * 1024 # 1.9GB limit
 WORKDIR = pathlib.Path("downloads")
+COMPRESS_TOLERANCE = 0.05 # Accept outputs landing within 5% under the target size
+COMPRESS_MAX_RETRIES = 2 # Extra second passes allowed after the first one misses
+COMPRESS_SIZES_MB = [25, 50, 100, 200, 500, 1000]
+MAX_JOBS = int(os.getenv("MAX_JOBS", 4)) # Heavy jobs (download/ffmpeg/upload) running at once; the rest queue
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", 2)) # So one user can't hold every slot
+DRAIN_DEADLINE = int(os.getenv("DRAIN_DEADLINE", 1800)) # Seconds a graceful restart waits for running jobs
+OPS_INTERVAL = 2 # Seconds between heartbeats / drain checks
+STREAM_CHUNK = 1024 * 1024 # Chunk size of Pyrogram's stream_media
+DOWNLOAD_RETRIES = 3 # Resume attempts after a dropped download
+STAGE_RETRIES = 1 # Re-runs of an ffmpeg stage whose output fails verification
+DURATION_TOLERANCE = 1.0 # Seconds an output may differ from the expected duration
+RATE_CAPACITY = float(os.getenv("RATE_CAPACITY", 10)) # Token bucket burst per user
+RATE_REFILL = float(os.getenv("RATE_REFILL", 0.2)) # Tokens regained per second (12 per minute)
+PREMIUM_RATE_MULTIPLIER = 3 # Premium users get a bucket this many times bigger and faster
+RATE_WARN_INTERVAL = 10 # Seconds between "slow down" replies to the same user
+# Tokens are charged by the step that starts a job; buttons inside a flow (cancel, show tags, custom size...) are free
+ACTION_COSTS = {"split": 5, "audio": 3, "gif": 3, "meta": 3} # Menu buttons that start a job at once
+STEP_COSTS = { # Flow state -> cost of the tap or reply that starts its job
+    "wait_res_selection": 5, "wait_cmp_selection": 5, "wait_cmp_size": 5, "merge_mode": 3,
+    "wait_name_input": 2, "wait_ts": 2, "wait_thumb": 2, "wait_meta_value": 2,
+}
+FLOW_MENUS = {"res", "compress", "merge_start", "rename", "ss", "thumb"} # Menu buttons that open a flow
+MENU_COST = 1 # Sending a file (opens the menu) or opening a flow
+MERGE_ADD_COST = 2 # Each video added in merge mode
 # WORKDIR.mkdir(exist_ok=True) # Removed from here, added to cleanup
 
 # State Management
 USER_STATE = {}
+JOBS = {} # job_id -> Job, mirrored into botstate for app.py
+FLOW_TASKS = {} # uid -> set of tasks running that user's handlers
+RATE_BUCKETS = {} # uid -> TokenBucket
+USER_SLOTS = {} # uid -> Semaphore(MAX_JOBS_PER_USER), dropped when the user has no jobs left
+DRAINING = False
+DRAIN_TEXT = "🚧 Bot is restarting for maintenance. Please try again in a few minutes."
+SUPERSEDED_TEXT = "✂️ **Cancelled:** replaced by your newer request."
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("UltimateBot")
@@ -52,8 +93,357 @@ def format_bytes(size: int) -> str:
         size /= 1024.0
     return f"{size:.2f} TB"
 
+def media_size(msg) -> int:
+    """Size of the media attached to a message, 0 if unknown."""
+    media = msg and (msg.video or msg.document or msg.audio)
+    return (media.file_size or 0) if media else 0
+
+def user_dir(uid: int) -> pathlib.Path:
+    """Per-user folder for outputs that keep a user-visible file name, so concurrent users can't collide."""
+    path = WORKDIR / str(uid)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def dir_usage(path: pathlib.Path):
+    """Returns (total bytes, file count) under path."""
+    total, count = 0, 0
+    for f in path.rglob("*"):
+        try:
+            if f.is_file():
+                total += f.stat().st_size
+                count += 1
+        except OSError:
+            pass # File removed by a finishing job while we walked
+    return total, count
+
+# ---------------- JOB TRACKING ----------------
+
+class JobSlots:
+    """MAX_JOBS slots handed out by lane (0 = priority, 1 = normal), first come first served within a lane."""
+
+    def __init__(self, size: int):
+        self.free = size
+        self._waiters = [] # heap of (lane, seq, future)
+        self._seq = itertools.count()
+
+    def locked(self) -> bool:
+        return self.free == 0
+
+    async def acquire(self, lane: int):
+        if self.free and not self._waiters:
+            self.free -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release() # The slot was handed over just as we were cancelled
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done(): # Skip waiters that were cancelled while queued
+                fut.set_result(None)
+                return
+        self.free += 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, lane: int):
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+JOB_SLOTS = JobSlots(MAX_JOBS)
+
+def lane_for(uid: int) -> int:
+    return 0 if uid == OWNER_ID or uid in PREMIUM_USERS else 1
+
+class Job:
+    """A unit of heavy work. Kept in memory; ops_loop publishes JOBS to botstate for app.py."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, uid: int, action: str, reserved_bytes: int, status=None):
+        self.uid = uid
+        self.action = action
+        self.reserved_bytes = reserved_bytes
+        self.status = status # The user's status message, if the job has one
+        self.id = next(self._ids)
+        self.stage_name = "queued"
+        self.percent = 0.0
+        self.started = self.updated = time.time()
+
+    def stage(self, name: str):
+        self.stage_name = name
+        self.percent = 0.0
+        self.updated = time.time()
+
+    async def progress(self, current: int, total: int):
+        """Pyrogram progress callback."""
+        if total:
+            self.percent = round(current / total * 100, 1)
+            self.updated = time.time()
+
+    def row(self) -> dict:
+        return {
+            "id": self.id, "uid": self.uid, "action": self.action, "stage": self.stage_name,
+            "progress": self.percent, "reserved_bytes": self.reserved_bytes,
+            "started": self.started, "updated": self.updated,
+        }
+
+class Draining(Exception):
+    """A new job was refused because the bot is draining for a restart."""
+
+    def __init__(self):
+        super().__init__(DRAIN_TEXT)
+
+@contextlib.asynccontextmanager
+async def track_job(uid: int, action: str, reserved_bytes: int = 0, status=None, finishing: bool = False):
+    """
+    Registers a job, waits for one of MAX_JOBS slots (owner and premium users first) and keeps
+    it visible to app.py until it ends. A user runs at most MAX_JOBS_PER_USER jobs at once; further
+    ones queue behind their own. reserved_bytes is the disk the job expects to need
+    (usually input + output). While draining, new jobs raise Draining before they are queued;
+    finishing=True still lets through the upload of output that already exists.
+    If the job is superseded (cancelled), its status message says so instead of hanging on
+    "Downloading..." or "Queued".
+    """
+    if DRAINING and not finishing:
+        raise Draining()
+    job = Job(uid, action, reserved_bytes, status)
+    JOBS[job.id] = job
+    user_slots = USER_SLOTS.setdefault(uid, asyncio.Semaphore(MAX_JOBS_PER_USER))
+    try:
+        if user_slots.locked() and status:
+            await status.edit_text(f"⏳ **Queued.** You already have {MAX_JOBS_PER_USER} job(s) running; this one starts when one finishes.")
+        elif JOB_SLOTS.locked() and status:
+            queued = sum(1 for j in JOBS.values() if j.stage_name == "queued")
+            await status.edit_text(f"⏳ **Queued** ({queued} job(s) waiting). I'll start as soon as a slot frees up.")
+        async with user_slots, JOB_SLOTS.slot(lane_for(uid)):
+            job.stage("running")
+            yield job
+    except asyncio.CancelledError:
+        if job.status:
+            with contextlib.suppress(Exception):
+                await job.status.edit_text(SUPERSEDED_TEXT)
+        raise
+    finally:
+        del JOBS[job.id]
+        if not any(j.uid == uid for j in JOBS.values()):
+            USER_SLOTS.pop(uid, None)
+
+def pending_outputs() -> int:
+    """
+    Finished outputs waiting for the user's "send as" choice, and merges that can be finished with
+    /done. A drain waits for them like for running jobs, since the restart wipes WORKDIR.
+    """
+    return sum(
+        1 for st in USER_STATE.values()
+        if st["action"] == "wait_format_selection" or (st["action"] == "merge_mode" and len(st["files"]) >= 2)
+    )
+
+def disk_stats() -> dict:
+    """Walks WORKDIR, so ops_loop runs it in a worker thread."""
+    work_bytes, work_files = dir_usage(WORKDIR) if WORKDIR.exists() else (0, 0)
+    disk = shutil.disk_usage(WORKDIR if WORKDIR.exists() else ".")
+    return {"workdir_bytes": work_bytes, "workdir_files": work_files, "disk_free_bytes": disk.free}
+
+def ops_snapshot(disk: dict) -> dict:
+    return {
+        "pid": os.getpid(),
+        "draining": DRAINING,
+        "jobs": len(JOBS),
+        "max_jobs": MAX_JOBS,
+        "pending_outputs": pending_outputs(),
+        "user_states": len(USER_STATE),
+        "rate_buckets": len(RATE_BUCKETS),
+        **disk,
+    }
+
+async def publish_state(disk: dict):
+    """Writes the heartbeat and the job table from a worker thread; a busy SQLite lock must not stall handlers."""
+    await asyncio.to_thread(botstate.publish, ops_snapshot(disk), [job.row() for job in JOBS.values()])
+
+async def ops_loop():
+    """Heartbeat for app.py, and the drain-and-restart driver. All disk and SQLite work runs off the loop."""
+    global DRAINING
+    while True:
+        try:
+            # Buckets that have refilled completely carry no state worth keeping
+            now = time.monotonic()
+            for uid, bucket in list(RATE_BUCKETS.items()):
+                if now - bucket.updated >= bucket.capacity / bucket.refill:
+                    del RATE_BUCKETS[uid]
+
+            disk = await asyncio.to_thread(disk_stats)
+            await publish_state(disk)
+            drain = await asyncio.to_thread(botstate.drain_request)
+            if drain and not DRAINING:
+                logger.info(
+                    f"🚧 Draining: {len(JOBS)} job(s) running, {pending_outputs()} output(s) waiting to be sent, "
+                    f"deadline in {drain['deadline'] - time.time():.0f}s"
+                )
+            elif not drain and DRAINING:
+                logger.info("▶️ Drain cancelled, accepting jobs again.")
+            DRAINING = bool(drain)
+
+            if DRAINING and (not (JOBS or pending_outputs()) or time.time() >= drain["deadline"]):
+                if JOBS or pending_outputs():
+                    logger.warning(f"Drain deadline passed with {len(JOBS)} job(s) running and {pending_outputs()} output(s) unsent.")
+                logger.info("🔄 Drain complete, restarting.")
+                await publish_state(disk)
+                await app.stop()
+                # The external process manager (like supervisor) restarts the bot on exit code 0
+                os._exit(0)
+        except Exception as e:
+            logger.error(f"Ops loop error: {e}")
+        await asyncio.sleep(OPS_INTERVAL)
+
+# ---------------- ADMISSION ----------------
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill: float):
+        self.capacity = capacity
+        self.refill = refill
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.warned = 0.0
+
+    def take(self, cost: float) -> float:
+        """Spends cost tokens and returns 0, or returns the seconds until they'd be available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.refill
+
+def bucket_for(uid: int) -> TokenBucket:
+    if uid not in RATE_BUCKETS:
+        scale = PREMIUM_RATE_MULTIPLIER if uid in PREMIUM_USERS else 1
+        RATE_BUCKETS[uid] = TokenBucket(RATE_CAPACITY * scale, RATE_REFILL * scale)
+    return RATE_BUCKETS[uid]
+
+def discard_state(uid: int):
+    """Drops the user's pending flow state and any files it was holding on to."""
+    st = USER_STATE.pop(uid, None) or {}
+    for f in [st.get("temp_path"), st.get("dl_path"), *st.get("files", [])]:
+        if f and os.path.exists(f): os.remove(f)
+    # Outputs of cancelled conversions live in the user's folder
+    shutil.rmtree(WORKDIR / str(uid), ignore_errors=True)
+
+async def supersede(uid: int):
+    """Cancels the user's running handlers before a new flow replaces their state."""
+    tasks = {task for task in FLOW_TASKS.get(uid, ()) if not task.done()}
+    if tasks:
+        logger.info(f"✂️ User {uid} started a new flow, cancelling {len(tasks)} superseded task(s)")
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks, timeout=10)
+    discard_state(uid)
+
+async def run_flow(uid: int, coro):
+    """
+    Runs a handler body as its own task, registered under the user, so a newer flow can cancel it
+    without taking down the Pyrogram worker that dispatched it.
+    """
+    task = asyncio.create_task(coro)
+    FLOW_TASKS.setdefault(uid, set()).add(task)
+    try:
+        await asyncio.wait([task])
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        FLOW_TASKS[uid].discard(task)
+        if not FLOW_TASKS[uid]:
+            del FLOW_TASKS[uid]
+    if not task.cancelled():
+        task.result() # Re-raise handler errors so Pyrogram logs them
+
+async def deny(update, text: str):
+    if hasattr(update, "answer"): # CallbackQuery: a popup costs nothing in the chat
+        await update.answer(text, show_alert=True)
+    else:
+        await update.reply_text(text)
+
+def admission(cost_of, finishing: bool = False):
+    """
+    Admission layer for entry-point handlers. cost_of(update) returns (token cost, starts a new flow).
+    Refuses work while draining (unless the handler is finishing=True, i.e. completes work the drain
+    is waiting for), applies the user's token bucket (the owner is exempt) and cancels the user's
+    superseded job when a new flow starts.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(c, update):
+            uid = update.from_user.id
+            cost, new_flow = cost_of(update)
+
+            if DRAINING and cost and not finishing:
+                await deny(update, DRAIN_TEXT)
+                return
+
+            if uid != OWNER_ID and cost:
+                bucket = bucket_for(uid)
+                wait = bucket.take(cost)
+                if wait:
+                    if time.monotonic() - bucket.warned >= RATE_WARN_INTERVAL or hasattr(update, "answer"):
+                        bucket.warned = time.monotonic()
+                        await deny(update, f"⏳ Slow down! Try again in {wait:.0f}s.")
+                    return
+
+            if new_flow:
+                await supersede(uid)
+            await run_flow(uid, func(c, update))
+        return wrapper
+    return decorator
+
+def flow_step(func):
+    """For handlers that continue a flow: no admission, but cancellable by the user's next flow."""
+    @functools.wraps(func)
+    async def wrapper(c, update):
+        await run_flow(update.from_user.id, func(c, update))
+    return wrapper
+
+def callback_cost(cb):
+    act = cb.data.split(":")[1]
+    if act in ACTION_COSTS:
+        return ACTION_COSTS[act], True
+    return (MENU_COST, True) if act in FLOW_MENUS else (0, False)
+
+def step_cost(*actions):
+    """cost_of for handlers that continue a flow: the step is charged only when it starts a job from one of actions."""
+    def cost_of(update):
+        st = USER_STATE.get(update.from_user.id)
+        return (STEP_COSTS[st["action"]] if st and st["action"] in actions else 0), False
+    return cost_of
+
+def message_cost(m):
+    st = USER_STATE.get(m.from_user.id)
+    return (MERGE_ADD_COST if st and st["action"] == "merge_mode" else MENU_COST), False
+
 # ---------------- FFMPEG TOOLS ----------------
 
+async def run_process(cmd: list, capture: bool = False):
+    """Runs a command to completion. If the job awaiting it is cancelled, the process is killed, not orphaned."""
+    pipe = asyncio.subprocess.PIPE if capture else None
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=pipe, stderr=pipe)
+    try:
+        stdout, stderr = await proc.communicate()
+    except asyncio.CancelledError:
+        with contextlib.suppress(ProcessLookupError):
+            proc.kill()
+        await proc.wait()
+        raise
+    return proc.returncode, stdout, stderr
+
 async def split_video(input_path: str, output_prefix: str):
     """Splits video into 1.9GB parts without re-encoding."""
     cmd = [
@@ -62,38 +452,36 @@ async def split_video(input_path: str, output_prefix: str):
         "-fs", str(SPLIT_SIZE_BYTES), "-reset_timestamps", "1", 
         f"{output_prefix}%03d.mp4"
     ]
-    proc = await asyncio.create_subprocess_exec(*cmd)
-    await proc.wait()
+    await run_process(cmd)
     return sorted(glob.glob(f"{output_prefix}*.mp4"))
 
 async def merge_videos(video_list: list, output_path: str):
     """Merges videos using concat demuxer."""
-    list_file = WORKDIR / f"merge_list_{int(time.time())}.txt"
+    list_file = pathlib.Path(output_path).with_suffix(".txt") # Named after the output, so concurrent merges can't collide
     with open(list_file, "w") as f:
         for vid in video_list:
             f.write(f"file '{os.path.abspath(vid)}'\n")
     
     cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(list_file), "-c", "copy", output_path]
-    proc = await asyncio.create_subprocess_exec(*cmd)
-    await proc.wait()
-    if os.path.exists(list_file): os.remove(list_file)
+    try:
+        await run_process(cmd)
+    finally:
+        if os.path.exists(list_file): os.remove(list_file)
     return os.path.exists(output_path)
 
 async def take_screenshot(input_path, output_path, timestamp):
     cmd = ["ffmpeg", "-y", "-ss", timestamp, "-i", input_path, "-vframes", "1", "-q:v", "2", output_path]
-    proc = await asyncio.create_subprocess_exec(*cmd)
-    await proc.wait()
-    return os.path.exists(output_path)
+    await run_process(cmd)
+    return os.path.exists(output_path) and os.path.getsize(output_path) > 0 # A timestamp past the end leaves an empty file
 
 async def extract_audio(input_path, output_path):
     cmd = ["ffmpeg", "-y", "-i", input_path, "-vn", "-acodec", "libmp3lame", "-q:a", "2", output_path]
-    proc = await asyncio.create_subprocess_exec(*cmd)
-    await proc.wait()
+    await run_process(cmd)
+    return os.path.exists(output_path)
 
 async def make_gif(input_path, output_path):
     cmd = ["ffmpeg", "-y", "-i", input_path, "-vf", "scale=320:-1:flags=lanczos,fps=10", "-t", "5", "-f", "gif", output_path]
-    proc = await asyncio.create_subprocess_exec(*cmd)
-    await proc.wait()
+    await run_process(cmd)
     return os.path.exists(output_path) and os.path.getsize(output_path) < 2097152
 
 async def convert_video_resolution(input_path: str, output_path: str, height: int):
@@ -106,10 +494,76 @@ async def convert_video_resolution(input_path: str, output_path: str, height: in
         "-c:a", "aac", "-b:a", "128k",
         output_path
     ]
-    proc = await asyncio.create_subprocess_exec(*cmd)
-    await proc.wait()
+    await run_process(cmd)
     return os.path.exists(output_path)
 
+async def _encode_pass(input_path: str, output_path: str, passlog: str, pass_no: int, video_kbps: int, audio_kbps: int):
+    cmd = [
+        "ffmpeg", "-y", "-i", input_path,
+        "-c:v", "libx264", "-preset", "medium", "-b:v", f"{video_kbps}k",
+        "-pass", str(pass_no), "-passlogfile", passlog,
+    ]
+    cmd += ["-c:a", "aac", "-b:a", f"{audio_kbps}k"] if audio_kbps else ["-an"]
+    cmd.append(output_path)
+    returncode, _, _ = await run_process(cmd)
+    return os.path.getsize(output_path) if returncode == 0 and os.path.exists(output_path) else None
+
+async def compress_to_size(input_path: str, output_path: str, target_bytes: int, passlog: str):
+    """
+    Encodes to h.264 MP4 so the output lands just under target_bytes.
+    Bitrates come from the probed duration. Pass 1 is x264's fast first pass, which also
+    writes the per-frame complexity log; if its output is already within COMPRESS_TOLERANCE
+    it is kept. Otherwise pass 2 re-encodes from that log, and every retry reuses the same
+    log with the bitrate scaled by the measured miss instead of re-analysing the video.
+    The caller owns passlog (and deletes it): when it already exists, e.g. because the last
+    output failed verification, pass 1 is skipped.
+    """
+    if os.path.getsize(input_path) <= target_bytes:
+        if os.path.exists(output_path): os.remove(output_path)
+        try:
+            os.link(input_path, output_path) # Same filesystem: no copy of a multi-GB file
+        except OSError:
+            await asyncio.to_thread(shutil.copy, input_path, output_path)
+        return True
+
+    info = await ffprobe_json(input_path)
+    if not info:
+        return False
+    duration = float(info.get("format", {}).get("duration") or 0)
+    if duration <= 0:
+        return False
+
+    # Keep ~3% headroom for the MP4 container, then split the budget between audio and video
+    total_kbps = target_bytes * 8 * 0.97 / duration / 1000
+    has_audio = any(st.get("codec_type") == "audio" for st in info.get("streams", []))
+    audio_kbps = (128 if total_kbps > 1000 else 64) if has_audio else 0
+    video_kbps = int(total_kbps - audio_kbps)
+    if video_kbps < 50:
+        logger.warning(f"Target of {format_bytes(target_bytes)} is too small for {duration:.0f}s of video")
+        return False
+
+    lower = target_bytes * (1 - COMPRESS_TOLERANCE)
+    if not os.path.exists(f"{passlog}-0.log"):
+        size = await _encode_pass(input_path, output_path, passlog, 1, video_kbps, audio_kbps)
+        if size is None:
+            return False
+        if lower <= size <= target_bytes:
+            logger.info(f"Compression hit {format_bytes(size)} in one pass")
+            return True
+    else:
+        logger.info("Reusing the x264 first-pass log")
+
+    for attempt in range(1 + COMPRESS_MAX_RETRIES):
+        if attempt:
+            # Aim for the middle of the tolerance window
+            video_kbps = int(video_kbps * target_bytes * (1 - COMPRESS_TOLERANCE / 2) / size)
+        size = await _encode_pass(input_path, output_path, passlog, 2, video_kbps, audio_kbps)
+        if size is None:
+            return False
+        if lower <= size <= target_bytes:
+            break
+    return size <= target_bytes
+
 async def update_metadata(input_path: str, output_path: str, key: str, value: str):
     """Updates a single metadata tag without re-encoding streams."""
     # Use -metadata tag=value and -c copy for fast modification
@@ -119,26 +573,34 @@ async def update_metadata(input_path: str, output_path: str, key: str, value: st
         "-c", "copy",
         output_path
     ]
-    proc = await asyncio.create_subprocess_exec(*cmd)
-    await proc.wait()
+    await run_process(cmd)
     return os.path.exists(output_path)
 
-async def ffprobe_metadata(input_path: str):
-    """Extracts stream and format metadata using ffprobe."""
+async def ffprobe_json(input_path: str):
+    """Returns ffprobe's format and streams description as a dict, or None on failure."""
     # ffprobe is used to quickly read the metadata structure
     cmd = [
         "ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", input_path
     ]
-    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    stdout, stderr = await proc.communicate()
+    returncode, stdout, stderr = await run_process(cmd, capture=True)
     
-    if proc.returncode != 0:
+    if returncode != 0:
         logger.error(f"FFprobe failed: {stderr.decode()}")
         return None
-        
+
     try:
-        data = json.loads(stdout.decode())
+        return json.loads(stdout.decode())
+    except Exception as e:
+        logger.error(f"Error parsing FFprobe JSON: {e}")
+        return None
+
+async def ffprobe_metadata(input_path: str):
+    """Extracts stream and format metadata using ffprobe."""
+    data = await ffprobe_json(input_path)
+    if data is None:
+        return None
         
+    try:
         metadata = {}
         # Format tags (general file metadata)
         if 'tags' in data.get('format', {}):
@@ -152,9 +614,175 @@ async def ffprobe_metadata(input_path: str):
                 
         return metadata
     except Exception as e:
-        logger.error(f"Error parsing FFprobe JSON: {e}")
+        logger.error(f"Error reading FFprobe tags: {e}")
         return None
 
+# ---------------- INTEGRITY ----------------
+
+class IntegrityError(Exception):
+    """A download or an ffmpeg output failed verification."""
+
+async def fetch_file_hashes(c, msg, offset: int) -> list:
+    """Telegram's SHA-256 of the media's byte ranges from offset on (upload.getFileHashes), as (offset, limit, digest)."""
+    media = msg.video or msg.document or msg.audio
+    file_id = FileId.decode(media.file_id)
+    location = raw.types.InputDocumentFileLocation(
+        id=file_id.media_id,
+        access_hash=file_id.access_hash,
+        file_reference=file_id.file_reference,
+        thumb_size=""
+    )
+    hashes = await c.invoke(raw.functions.upload.GetFileHashes(location=location, offset=offset))
+    return [(h.offset, h.limit, h.hash) for h in hashes]
+
+class RangeHashes:
+    """
+    Server-side hashes of one download, fetched in batches just ahead of the stream.
+    If Telegram won't hand them out (e.g. the file lives on another DC), checks fall back to length only.
+    """
+
+    def __init__(self, c, msg):
+        self.c = c
+        self.msg = msg
+        self.ranges = {} # offset -> (limit, sha256 digest)
+        self.fetched = 0 # Bytes covered by the batches so far
+        self.exhausted = False
+        self.available = True
+
+    async def _fetch_until(self, position: int):
+        while self.available and not self.exhausted and self.fetched < position:
+            try:
+                batch = await fetch_file_hashes(self.c, self.msg, self.fetched)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.ranges: # Asking past the end of the file
+                    self.exhausted = True
+                else:
+                    logger.warning(f"File hashes unavailable ({e}), checking length only")
+                    self.available = False
+                return
+            if not batch:
+                self.exhausted = True
+                return
+            for offset, limit, digest in batch:
+                self.ranges[offset] = (limit, digest)
+                self.fetched = max(self.fetched, offset + limit)
+
+    async def check(self, offset: int, data: bytes):
+        """Compares every hashed range inside the chunk at offset; raises IntegrityError on a mismatch."""
+        await self._fetch_until(offset + len(data))
+        pos = offset
+        while pos in self.ranges:
+            limit, digest = self.ranges[pos]
+            piece = data[pos - offset:pos - offset + limit]
+            if not piece or (len(piece) < limit and len(data) == STREAM_CHUNK):
+                break # Range continues in the next chunk
+            if hashlib.sha256(piece).digest() != digest:
+                raise IntegrityError(f"bytes {pos}-{pos + len(piece)} don't match Telegram's hash")
+            pos += limit
+
+    async def check_complete(self, size: int):
+        """Catches a download that stopped early even when the message didn't report a size."""
+        await self._fetch_until(size + 1)
+        if any(offset >= size for offset in self.ranges):
+            raise IntegrityError(f"download ended at {format_bytes(size)}, Telegram has more")
+
+    @property
+    def mode(self) -> str:
+        return "hash-verified" if self.available and self.ranges else "length-checked"
+
+async def download_verified(c, msg, path, progress=None) -> int:
+    """
+    Streams the media of msg to path, hashing every chunk as it arrives and comparing it with
+    Telegram's own per-range SHA-256 (upload.getFileHashes) before it is written; every chunk but
+    the last must also be full size and the total must match. A corrupted or short chunk, or a
+    dropped connection, only re-fetches from that chunk on. Returns the bytes written.
+    """
+    expected = media_size(msg)
+    hashes = RangeHashes(c, msg)
+    done = 0 # Chunks verified and written
+    failures = 0
+
+    with open(path, "wb") as f:
+        while True:
+            try:
+                async for chunk in c.stream_media(msg, offset=done):
+                    if len(chunk) < STREAM_CHUNK and f.tell() + len(chunk) < expected:
+                        raise IntegrityError(f"short chunk #{done} ({len(chunk)} bytes)")
+                    await hashes.check(done * STREAM_CHUNK, chunk)
+                    f.write(chunk)
+                    done += 1
+                    if progress:
+                        await progress(f.tell(), expected)
+                if expected and f.tell() != expected:
+                    raise IntegrityError(f"got {format_bytes(f.tell())} of {format_bytes(expected)}")
+                await hashes.check_complete(f.tell())
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                if failures > DOWNLOAD_RETRIES:
+                    raise IntegrityError(f"Download failed after {DOWNLOAD_RETRIES} retries: {e}")
+                logger.warning(f"Download of {pathlib.Path(path).name} broke at chunk {done} ({e}), resuming")
+                f.seek(done * STREAM_CHUNK)
+                f.truncate()
+                await asyncio.sleep(failures)
+
+        size = f.tell()
+
+    logger.info(f"⬇️ {pathlib.Path(path).name}: {format_bytes(size)} in {done} chunk(s), {hashes.mode}, {failures} resume(s)")
+    return size
+
+def stream_kinds(info: dict) -> set:
+    return {st.get("codec_type") for st in info.get("streams", [])} & {"video", "audio"}
+
+def probe_duration(info: dict) -> float:
+    return float(info.get("format", {}).get("duration") or 0)
+
+async def probe_input(path) -> dict:
+    """ffprobe a downloaded file; unreadable media is rejected before any encode starts."""
+    info = await ffprobe_json(str(path))
+    if not info or not stream_kinds(info):
+        raise IntegrityError("The file isn't readable media.")
+    return info
+
+async def verify_output(path, expected_duration: float = 0, expected_kinds: set = frozenset(), tolerance: float = DURATION_TOLERANCE) -> dict:
+    """
+    Fast ffprobe check of an ffmpeg output before upload: it must parse, carry the expected
+    stream kinds and last as long as expected. Returns the probe data.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        raise IntegrityError(f"{pathlib.Path(path).name} was not produced")
+    info = await ffprobe_json(str(path))
+    if not info:
+        raise IntegrityError(f"{pathlib.Path(path).name} is not readable")
+    missing = set(expected_kinds) - stream_kinds(info)
+    if missing:
+        raise IntegrityError(f"{pathlib.Path(path).name} lost its {', '.join(sorted(missing))} stream")
+    duration = probe_duration(info)
+    if expected_duration and abs(duration - expected_duration) > max(tolerance, expected_duration * 0.01):
+        raise IntegrityError(f"{pathlib.Path(path).name} lasts {duration:.1f}s, expected {expected_duration:.1f}s")
+    return info
+
+async def run_stage(name: str, run, verify):
+    """
+    Runs an ffmpeg stage and, if its output fails verification, re-runs only that stage.
+    A falsy result means the stage reported its own failure and is returned unverified.
+    """
+    for attempt in range(STAGE_RETRIES + 1):
+        result = await run()
+        if not result:
+            return result
+        try:
+            await verify(result)
+            return result
+        except IntegrityError as e:
+            if attempt == STAGE_RETRIES:
+                raise
+            logger.warning(f"{name} output failed verification ({e}), re-running {name}")
+
 # ---------------- BOT LOGIC ----------------
 
 @app.on_message(filters.command("start"))
@@ -167,10 +795,11 @@ async def start(c, m):
         "🔹 **Rename & Convert**\n"
         "🔹 **Thumbnails & Screenshots**\n\n"
         "**Send a file to begin.**\n\n"
-        f"**Admin Commands:** /restart (Owner ID: `{OWNER_ID}`)"
+        f"**Admin Commands:** /restart (graceful), /restart now (Owner ID: `{OWNER_ID}`)"
     )
 
 @app.on_message(filters.command("done"))
+@admission(step_cost("merge_mode"), finishing=True)
 async def done_merge(c, m):
     uid = m.from_user.id
     if uid not in USER_STATE or USER_STATE[uid]["action"] != "merge_mode":
@@ -178,25 +807,38 @@ async def done_merge(c, m):
         return
         
     files = USER_STATE[uid]["files"]
+    probes = USER_STATE[uid]["probes"]
     if len(files) < 2:
         await m.reply_text("❌ Send at least 2 videos.")
         return
 
+    # Leave merge mode first so a repeated /done can't start a second merge (files stay tracked for cleanup)
+    USER_STATE[uid]["action"] = "merging"
     status = await m.reply_text(f"🔗 **Merging {len(files)} videos...**")
     out_path = WORKDIR / f"merged_{uid}.mp4"
     
     try:
-        if await merge_videos(files, str(out_path)):
-            await m.reply_video(str(out_path), caption="**✨ Merged!**")
-            await status.delete()
-        else:
-            await status.edit("❌ Merge failed. Ensure videos are same format.")
+        async with track_job(uid, "merge", sum(os.path.getsize(f) for f in files), status, finishing=True) as job:
+            job.stage("merging")
+            expected = sum(probe_duration(p) for p in probes)
+            merged = await run_stage(
+                "merge",
+                lambda: merge_videos(files, str(out_path)),
+                lambda _: verify_output(out_path, expected, stream_kinds(probes[0]), DURATION_TOLERANCE * len(files))
+            )
+            if merged:
+                job.stage("uploading")
+                await m.reply_video(str(out_path), caption="**✨ Merged!**", progress=job.progress)
+                await status.delete()
+            else:
+                await status.edit("❌ Merge failed. Ensure videos are same format.")
     except Exception as e:
         await status.edit(f"Error: {e}")
     finally:
-        for f in files: os.remove(f)
+        for f in files:
+            if os.path.exists(f): os.remove(f)
         if out_path.exists(): os.remove(out_path)
-        del USER_STATE[uid]
+        USER_STATE.pop(uid, None)
 
 # ---------------- ADMIN COMMANDS ----------------
 
@@ -204,8 +846,18 @@ async def done_merge(c, m):
 async def restart_command(client, message):
     """
     Handles the /restart command.
-    Uses the provided decorative message but executes a clean exit for restart.
+    `/restart` drains: new jobs are refused and the bot exits once running jobs finish and
+    finished outputs are sent (or DRAIN_DEADLINE passes). `/restart now` keeps the old immediate exit.
     """
+    if len(message.command) < 2 or message.command[1].lower() != "now":
+        await asyncio.to_thread(botstate.request_drain, DRAIN_DEADLINE)
+        await message.reply_text(
+            f"🚧 **Draining.** New jobs are refused; restarting after {len(JOBS)} running job(s) finish "
+            f"and {pending_outputs()} finished output(s) are sent "
+            f"(at most {DRAIN_DEADLINE // 60} min). Use `/restart now` to skip the wait."
+        )
+        return
+
     try:
         # Use the decorative status message before exiting
         await message.reply_text("🔄 **𝙿𝚁𝙾𝙲𝙴𝚂𝚂𝙴𝚂 𝚂𝚃𝙾𝙿𝙴𝙳. 𝙱𝙾𝚃 𝙸𝚂 𝚁𝙴𝚂𝚃𝙰𝚁𝚃𝙸𝙽𝙶...**")
@@ -225,6 +877,7 @@ async def restart_command(client, message):
 # ---------------- MEDIA HANDLERS ----------------
 
 @app.on_message(filters.video | filters.document | filters.audio)
+@admission(message_cost)
 async def main_handler(c, m: Message):
     uid = m.from_user.id
     
@@ -234,11 +887,29 @@ async def main_handler(c, m: Message):
             await m.reply_text("❌ Send VIDEOS only for merging.")
             return
         
-        path = WORKDIR / f"merge_{uid}_{len(USER_STATE[uid]['files'])}.mp4"
+        st = USER_STATE[uid]
+        path = WORKDIR / f"merge_{uid}_{m.id}.mp4" # Message id, so videos sent back to back can't share a file
         msg = await m.reply_text("📥 **Added to Queue...**")
-        await m.download(str(path))
-        USER_STATE[uid]["files"].append(str(path))
-        await msg.edit_text(f"✅ **Video #{len(USER_STATE[uid]['files'])} Added.**\nType **/done** to finish.")
+        try:
+            async with track_job(uid, "merge_download", media_size(m), msg) as job:
+                job.stage("downloading")
+                await download_verified(c, m, path, job.progress)
+                info = await probe_input(path)
+            if USER_STATE.get(uid) is not st or st["action"] != "merge_mode":
+                await msg.edit_text("❌ Merge mode ended before this video finished downloading.")
+                return
+            st["files"].append(str(path))
+            st["probes"].append(info)
+        except IntegrityError as e:
+            await msg.edit_text(f"❌ That video didn't arrive intact ({e}). Please send it again.")
+            return
+        except Draining:
+            await msg.edit_text(DRAIN_TEXT)
+            return
+        finally:
+            # Until it is in the list, nothing else will clean the file up (cancelled, failed or too late)
+            if str(path) not in st["files"] and path.exists(): os.remove(path)
+        await msg.edit_text(f"✅ **Video #{len(st['files'])} Added.**\nType **/done** to finish.")
         return
 
     # 2. Thumbnail Collection
@@ -252,11 +923,12 @@ async def main_handler(c, m: Message):
         [InlineKeyboardButton("➕ Merge", "act:merge_start"), InlineKeyboardButton("🔪 Split (>2GB)", "act:split")],
         [InlineKeyboardButton("🎞 GIF", "act:gif"), InlineKeyboardButton("📐 Change Res", "act:res")], 
         [InlineKeyboardButton("📸 Screenshot", "act:ss"), InlineKeyboardButton("🖼 Set Thumb", "act:thumb")],
-        [InlineKeyboardButton("🏷 Metadata", "act:meta")] 
+        [InlineKeyboardButton("🏷 Metadata", "act:meta"), InlineKeyboardButton("🗜 Compress", "act:compress")]
     ]
     await m.reply_text(f"**File:** `{fname}`\nSelect Operation:", reply_markup=InlineKeyboardMarkup(buttons), quote=True)
 
 @app.on_callback_query(filters.regex("^act:"))
+@admission(callback_cost)
 async def callbacks(c, cb: CallbackQuery):
     act = cb.data.split(":")[1]
     msg = cb.message.reply_to_message
@@ -264,7 +936,7 @@ async def callbacks(c, cb: CallbackQuery):
 
     if act == "merge_start":
         await cb.answer()
-        USER_STATE[uid] = {"action": "merge_mode", "files": []}
+        USER_STATE[uid] = {"action": "merge_mode", "files": [], "probes": []}
         await cb.message.edit_text("🔗 **Merge Mode On.**\nSend videos one by one.\nType **/done** when finished.")
         return
 
@@ -278,12 +950,17 @@ async def callbacks(c, cb: CallbackQuery):
         status = await cb.message.reply_text("📥 **Downloading file to read metadata...**")
         
         dl = WORKDIR / f"meta_temp_{uid}.mp4" 
+        # Track the download from the start, so a superseding flow deletes a partial file
+        USER_STATE[uid] = {"action": "meta_download", "dl_path": str(dl)}
 
         try:
-            await msg.download(str(dl))
-            
-            # Read metadata
-            metadata = await ffprobe_metadata(str(dl))
+            async with track_job(uid, "meta", media_size(msg), status) as job:
+                job.stage("downloading")
+                await download_verified(c, msg, dl, job.progress)
+                
+                # Read metadata
+                job.stage("probing")
+                metadata = await ffprobe_metadata(str(dl))
             
             # Store necessary state
             USER_STATE[uid] = {
@@ -308,7 +985,7 @@ async def callbacks(c, cb: CallbackQuery):
         except Exception as e:
             await status.edit_text(f"❌ Error during metadata download: {e}")
             if dl.exists(): os.remove(dl)
-            del USER_STATE[uid]
+            USER_STATE.pop(uid, None)
         return
 
     elif act == "meta_show":
@@ -406,28 +1083,83 @@ async def callbacks(c, cb: CallbackQuery):
         await cb.message.edit_text("📐 Resolution change cancelled.")
         return
 
+    if act == "compress":
+        await cb.answer()
+        media = msg.video or msg.document or msg.audio
+        size_text = f"\n📦 **Current Size:** `{format_bytes(media.file_size)}`" if media and media.file_size else ""
+        sizes = [InlineKeyboardButton(f"{mb} MB", f"cmp:{mb}") for mb in COMPRESS_SIZES_MB]
+        buttons = [sizes[i:i + 3] for i in range(0, len(sizes), 3)]
+        buttons += [
+            [InlineKeyboardButton("✍️ Custom Size", "act:cmp_custom")],
+            [InlineKeyboardButton("❌ Cancel", "act:cancel_cmp")]
+        ]
+        await cb.message.edit_text(
+            "🗜 **Compress to Target Size**\n\n"
+            "Pick the maximum size of the output. The bitrate is calculated from the video length, "
+            "so the result fits without guessing resolutions." + size_text,
+            reply_markup=InlineKeyboardMarkup(buttons)
+        )
+        USER_STATE[uid] = {"action": "wait_cmp_selection", "msg": msg}
+        return
+
+    if act == "cmp_custom":
+        st = USER_STATE.get(uid)
+        if not st or st['action'] != 'wait_cmp_selection':
+            await cb.answer("❌ Please start over.", show_alert=True)
+            return
+        await cb.answer()
+        USER_STATE[uid]["action"] = "wait_cmp_size"
+        await cb.message.reply_text("🗜 **Target size in MB?** (e.g. 45 or 9.5)", reply_markup=ForceReply())
+        return
+
+    if act == "cancel_cmp":
+        if uid in USER_STATE and USER_STATE[uid].get('action') in ('wait_cmp_selection', 'wait_cmp_size'):
+            del USER_STATE[uid]
+        await cb.message.edit_text("🗜 Compression cancelled.")
+        return
+
     if act == "split":
         await cb.answer("Checking size...")
         status = await cb.message.reply_text("📥 **Downloading...**")
         dl = WORKDIR / f"big_{uid}.mp4"
         prefix = WORKDIR / f"part_{uid}_"
         try:
-            await msg.download(str(dl))
-            if os.path.getsize(dl) < SPLIT_SIZE_BYTES:
-                await status.edit("🤔 File is small (<1.9GB). Sending back.")
-                await c.send_document(cb.message.chat.id, str(dl))
-            else:
-                await status.edit("🔪 **Splitting...**")
-                parts = await split_video(str(dl), str(prefix))
-                await status.edit(f"📦 **Uploading {len(parts)} parts...**")
-                for i, p in enumerate(parts):
-                    await c.send_document(cb.message.chat.id, p, caption=f"Part {i+1}")
-                    os.remove(p)
-                await status.delete()
+            async with track_job(uid, "split", media_size(msg) * 2, status) as job:
+                job.stage("downloading")
+                await download_verified(c, msg, dl, job.progress)
+                if os.path.getsize(dl) < SPLIT_SIZE_BYTES:
+                    await status.edit("🤔 File is small (<1.9GB). Sending back.")
+                    job.stage("uploading")
+                    await c.send_document(cb.message.chat.id, str(dl), progress=job.progress)
+                else:
+                    await status.edit("🔪 **Splitting...**")
+                    src = await probe_input(dl)
+
+                    async def split():
+                        for old in glob.glob(f"{glob.escape(str(prefix))}*.mp4"): os.remove(old)
+                        return await split_video(str(dl), str(prefix))
+
+                    async def verify_parts(parts):
+                        infos = [await verify_output(p, 0, stream_kinds(src)) for p in parts]
+                        total = sum(probe_duration(i) for i in infos)
+                        if abs(total - probe_duration(src)) > max(DURATION_TOLERANCE * len(parts), probe_duration(src) * 0.01):
+                            raise IntegrityError(f"parts last {total:.1f}s, source {probe_duration(src):.1f}s")
+
+                    job.stage("splitting")
+                    parts = await run_stage("split", split, verify_parts)
+                    if not parts:
+                        raise IntegrityError("ffmpeg produced no parts")
+                    await status.edit(f"📦 **Uploading {len(parts)} parts...**")
+                    for i, p in enumerate(parts):
+                        job.stage(f"uploading {i+1}/{len(parts)}")
+                        await c.send_document(cb.message.chat.id, p, caption=f"Part {i+1}", progress=job.progress)
+                        os.remove(p)
+                    await status.delete()
         except Exception as e:
             await status.edit(f"Error: {e}")
         finally:
             if dl.exists(): os.remove(dl)
+            for p in glob.glob(f"{glob.escape(str(prefix))}*.mp4"): os.remove(p)
 
     elif act == "audio":
         await cb.answer("Extracting...")
@@ -435,10 +1167,23 @@ async def callbacks(c, cb: CallbackQuery):
         dl = WORKDIR / f"v_{uid}.mp4"
         out = WORKDIR / f"a_{uid}.mp3"
         try:
-            await msg.download(str(dl))
-            await extract_audio(str(dl), str(out))
-            await c.send_audio(cb.message.chat.id, str(out))
-            await status.delete()
+            async with track_job(uid, "audio", media_size(msg) * 2, status) as job:
+                job.stage("downloading")
+                await download_verified(c, msg, dl, job.progress)
+                src = await probe_input(dl)
+                if "audio" not in stream_kinds(src):
+                    raise IntegrityError("This file has no audio track.")
+                job.stage("extracting")
+                extracted = await run_stage(
+                    "audio",
+                    lambda: extract_audio(str(dl), str(out)),
+                    lambda _: verify_output(out, probe_duration(src), {"audio"})
+                )
+                if not extracted:
+                    raise IntegrityError("ffmpeg produced no audio")
+                job.stage("uploading")
+                await c.send_audio(cb.message.chat.id, str(out), progress=job.progress)
+                await status.delete()
         except Exception as e:
             await status.edit(f"Error: {e}")
         finally:
@@ -451,12 +1196,26 @@ async def callbacks(c, cb: CallbackQuery):
         dl = WORKDIR / f"g_{uid}.mp4"
         out = WORKDIR / f"g_{uid}.gif"
         try:
-            await msg.download(str(dl))
-            if await make_gif(str(dl), str(out)):
-                await c.send_animation(cb.message.chat.id, str(out))
-                await status.delete()
-            else:
-                await status.edit("❌ GIF failed (too big).")
+            async with track_job(uid, "gif", media_size(msg), status) as job:
+                job.stage("downloading")
+                await download_verified(c, msg, dl, job.progress)
+                src = await probe_input(dl)
+                job.stage("encoding")
+                made = await run_stage(
+                    "gif",
+                    lambda: make_gif(str(dl), str(out)),
+                    lambda _: verify_output(out, min(5, probe_duration(src)), {"video"})
+                )
+                if made:
+                    job.stage("uploading")
+                    await c.send_animation(cb.message.chat.id, str(out), progress=job.progress)
+                    await status.delete()
+                else:
+                    await status.edit("❌ GIF failed (too big).")
+        except IntegrityError as e:
+            await status.edit(f"❌ GIF failed: {e}")
+        except Draining:
+            await status.edit(DRAIN_TEXT)
         finally:
             if dl.exists(): os.remove(dl)
             if out.exists(): os.remove(out)
@@ -477,6 +1236,7 @@ async def callbacks(c, cb: CallbackQuery):
         await cb.message.reply_text("🖼 **Send a Photo.**", reply_markup=ForceReply())
 
 @app.on_callback_query(filters.regex("^res:"))
+@admission(step_cost("wait_res_selection"))
 async def res_select(c, cb: CallbackQuery):
     _, height_str = cb.data.split(":") # Now expecting height (e.g., 720)
     uid = cb.from_user.id
@@ -488,20 +1248,32 @@ async def res_select(c, cb: CallbackQuery):
         return
         
     msg = st['msg']
+    # Leave the selection state first so a repeat tap can't start a second conversion
+    USER_STATE[uid] = {"action": "converting"}
     
     status = await cb.message.edit_text(f"📥 **Downloading & Converting to {height}p...**")
     
     dl = WORKDIR / f"res_in_{uid}.mp4"
     # Use height in the output name
     out_name = f"converted_{height}p_{msg.video.file_name if msg.video else 'file.mp4'}"
-    out_path = WORKDIR / out_name
+    out_path = user_dir(uid) / out_name
     
     try:
-        await msg.download(str(dl))
-        await status.edit_text(f"📐 **Converting to {height}p...** This may take a while.")
-        
-        # Pass height to the conversion function
-        if await convert_video_resolution(str(dl), str(out_path), height):
+        async with track_job(uid, f"res {height}p", media_size(msg) * 2, status) as job:
+            job.stage("downloading")
+            await download_verified(c, msg, dl, job.progress)
+            src = await probe_input(dl)
+            await status.edit_text(f"📐 **Converting to {height}p...** This may take a while.")
+            
+            # Pass height to the conversion function
+            job.stage("converting")
+            converted = await run_stage(
+                "convert",
+                lambda: convert_video_resolution(str(dl), str(out_path), height),
+                lambda _: verify_output(out_path, probe_duration(src), stream_kinds(src))
+            )
+
+        if converted:
             
             # Calculate file size and format it
             new_size_bytes = os.path.getsize(out_path)
@@ -538,7 +1310,81 @@ async def res_select(c, cb: CallbackQuery):
         if dl.exists(): os.remove(dl)
         # out_path is cleaned up in format_callbacks
 
+async def run_compression(c, status, uid: int, msg, target_mb: float):
+    """Downloads the file, compresses it to target_mb and hands over to format selection."""
+    dl = WORKDIR / f"cmp_in_{uid}.mp4"
+    out_name = f"compressed_{target_mb:g}MB_{msg.video.file_name if msg.video else 'file.mp4'}"
+    out_path = user_dir(uid) / out_name
+    # Lives for the whole job, so a re-run after failed verification reuses the first pass
+    passlog = str(out_path.with_name(f"x264_{out_path.stem}"))
+
+    try:
+        async with track_job(uid, f"compress {target_mb:g}MB", media_size(msg) * 2, status) as job:
+            job.stage("downloading")
+            await download_verified(c, msg, dl, job.progress)
+            src = await probe_input(dl)
+            await status.edit_text(f"🗜 **Compressing to {target_mb:g} MB...** This may take a while.")
+            job.stage("compressing")
+            compressed = await run_stage(
+                "compress",
+                lambda: compress_to_size(str(dl), str(out_path), int(target_mb * 1024 * 1024), passlog),
+                lambda _: verify_output(out_path, probe_duration(src), stream_kinds(src))
+            )
+
+        if compressed:
+            USER_STATE[uid] = {
+                "action": "wait_format_selection",
+                "temp_path": str(out_path),
+                "new_name": out_name,
+            }
+
+            buttons = [
+                [InlineKeyboardButton("🎥 Send as VIDEO", f"format:video:{uid}")],
+                [InlineKeyboardButton("📄 Send as FILE/Document", f"format:document:{uid}")]
+            ]
+
+            await status.edit_text(
+                f"✅ Compression complete.\n"
+                f"📦 **New Size:** `{format_bytes(os.path.getsize(out_path))}`\n\n"
+                "**How should I send the compressed file?**",
+                reply_markup=InlineKeyboardMarkup(buttons)
+            )
+
+        else:
+            await status.edit_text("❌ Compression failed. The target may be too small for this video.")
+            if out_path.exists(): os.remove(out_path)
+            del USER_STATE[uid]
+
+    except Exception as e:
+        await status.edit_text(f"❌ Error during compression: {e}")
+        if out_path.exists(): os.remove(out_path)
+        del USER_STATE[uid]
+
+    finally:
+        if dl.exists(): os.remove(dl)
+        for f in glob.glob(f"{glob.escape(passlog)}*"):
+            os.remove(f)
+        # out_path is cleaned up in format_callbacks
+
+@app.on_callback_query(filters.regex("^cmp:"))
+@admission(step_cost("wait_cmp_selection"))
+async def compress_select(c, cb: CallbackQuery):
+    _, mb_str = cb.data.split(":")
+    uid = cb.from_user.id
+
+    st = USER_STATE.get(uid)
+    if not st or st['action'] != 'wait_cmp_selection':
+        await cb.answer("❌ State expired. Please start over from the main menu.", show_alert=True)
+        return
+
+    target_mb = float(mb_str)
+    # Leave the selection state first so a repeat tap can't start a second compression
+    USER_STATE[uid] = {"action": "compressing"}
+    status = await cb.message.edit_text(f"📥 **Downloading & Compressing to {target_mb:g} MB...**")
+    await run_compression(c, status, uid, st['msg'], target_mb)
+
 @app.on_callback_query(filters.regex("^format:"))
+@flow_step
 async def format_callbacks(c, cb: CallbackQuery):
     _, act_type, uid_str = cb.data.split(":")
     uid = int(uid_str) # Get the original user ID
@@ -556,19 +1402,23 @@ async def format_callbacks(c, cb: CallbackQuery):
         if not file_path.exists():
             raise FileNotFoundError("Temporary file not found.")
 
-        # Determine the Telegram function based on the button clicked
-        if act_type == "video":
-            await c.send_video(
-                cb.message.chat.id, 
-                str(file_path), 
-                caption=f"🎥 **Renamed/Converted:** `{st['new_name']}`"
-            )
-        elif act_type == "document":
-            await c.send_document(
-                cb.message.chat.id, 
-                str(file_path), 
-                caption=f"📄 **Renamed/Converted:** `{st['new_name']}`"
-            )
+        async with track_job(uid, f"send {act_type}", 0, status, finishing=True) as job:
+            job.stage("uploading")
+            # Determine the Telegram function based on the button clicked
+            if act_type == "video":
+                await c.send_video(
+                    cb.message.chat.id, 
+                    str(file_path), 
+                    caption=f"🎥 **Renamed/Converted:** `{st['new_name']}`",
+                    progress=job.progress
+                )
+            elif act_type == "document":
+                await c.send_document(
+                    cb.message.chat.id, 
+                    str(file_path), 
+                    caption=f"📄 **Renamed/Converted:** `{st['new_name']}`",
+                    progress=job.progress
+                )
             
         await status.edit_text("✨ **File Sent!**")
 
@@ -584,6 +1434,7 @@ async def format_callbacks(c, cb: CallbackQuery):
 
 
 @app.on_message(filters.text & filters.private)
+@admission(step_cost("wait_name_input", "wait_ts", "wait_cmp_size", "wait_meta_value"))
 async def inputs(c, m):
     uid = m.from_user.id
     if uid not in USER_STATE: return
@@ -593,12 +1444,15 @@ async def inputs(c, m):
     # ------------------ 1. RENAME INPUT (New Name) ------------------
     if st["action"] == "wait_name_input":
         new_filename = m.text.replace("/", "_")
-        path = WORKDIR / new_filename 
+        path = user_dir(uid) / new_filename 
+        USER_STATE[uid] = {"action": "renaming"} # A repeated reply must not start a second download
         
         status = await m.reply_text("📥 **Downloading original file...**")
         
         try:
-            await st["msg"].download(str(path))
+            async with track_job(uid, "rename", media_size(st["msg"]), status) as job:
+                job.stage("downloading")
+                await download_verified(c, st["msg"], path, job.progress)
             
             # Transition to format selection state
             USER_STATE[uid] = {
@@ -628,22 +1482,52 @@ async def inputs(c, m):
     # ------------------ 2. SCREENSHOT INPUT (Timestamp) ------------------
     elif st["action"] == "wait_ts":
         ts = m.text.replace(" call on ", ":").replace(".", ":")
+        USER_STATE[uid] = {"action": "capturing"}
         status = await m.reply_text("📸 **Capturing...**")
         dl = WORKDIR / f"s_{uid}.mp4"
         out = WORKDIR / f"s_{uid}.jpg"
         try:
-            await st["msg"].download(str(dl))
-            if await take_screenshot(str(dl), str(out), ts):
-                await m.reply_photo(str(out), caption=f"Time: {ts}")
-                await status.delete()
-            else:
-                await status.edit("❌ Invalid timestamp.")
+            async with track_job(uid, "screenshot", media_size(st["msg"]), status) as job:
+                job.stage("downloading")
+                await download_verified(c, st["msg"], dl, job.progress)
+                await probe_input(dl)
+                job.stage("capturing")
+                captured = await run_stage(
+                    "screenshot",
+                    lambda: take_screenshot(str(dl), str(out), ts),
+                    lambda _: verify_output(out, 0, {"video"})
+                )
+                if captured:
+                    job.stage("uploading")
+                    await m.reply_photo(str(out), caption=f"Time: {ts}")
+                    await status.delete()
+                else:
+                    await status.edit("❌ Invalid timestamp.")
+        except IntegrityError as e:
+            await status.edit(f"❌ Screenshot failed: {e}")
+        except Draining:
+            await status.edit(DRAIN_TEXT)
         finally:
             if dl.exists(): os.remove(dl)
             if out.exists(): os.remove(out)
-            del USER_STATE[uid]
+            USER_STATE.pop(uid, None)
             
-    # ------------------ 3. METADATA KEY INPUT ------------------
+    # ------------------ 3. COMPRESSION TARGET INPUT ------------------
+    elif st["action"] == "wait_cmp_size":
+        try:
+            target_mb = float(m.text.strip().lower().replace("mb", "").strip())
+        except ValueError:
+            target_mb = 0
+        if not 0 < target_mb <= 4000:
+            await m.reply_text("❌ Send the size as a number of MB, e.g. `45`.")
+            return
+
+        USER_STATE[uid] = {"action": "compressing"}
+        status = await m.reply_text(f"📥 **Downloading & Compressing to {target_mb:g} MB...**")
+        await run_compression(c, status, uid, st["msg"], target_mb)
+        return
+
+    # ------------------ 4. METADATA KEY INPUT ------------------
     elif st["action"] == "wait_meta_key":
         meta_key = m.text.strip().replace(":", "_").replace("=", "_")
         if not meta_key:
@@ -660,10 +1544,11 @@ async def inputs(c, m):
         )
         return
 
-    # ------------------ 4. METADATA VALUE INPUT ------------------
+    # ------------------ 5. METADATA VALUE INPUT ------------------
     elif st["action"] == "wait_meta_value":
         meta_value = m.text.strip()
         meta_key = st["meta_key"]
+        USER_STATE[uid] = {"action": "tagging", "dl_path": st["dl_path"]}
         
         status = await m.reply_text(f"🏷 **Updating tag `{meta_key}` to `{meta_value}`...**")
         
@@ -679,21 +1564,30 @@ async def inputs(c, m):
             if not os.path.exists(dl_path):
                  raise FileNotFoundError("Original file lost.")
                  
-            # 1. Update metadata (This is usually very fast)
-            await status.edit_text(f"🔧 **Applying new metadata tag...**")
-            success = await update_metadata(str(dl_path), str(out_path), meta_key, meta_value)
-
-            if success:
-                # 2. Upload the new file
-                await status.edit_text(f"📤 **Uploading edited file...**")
-                await c.send_document(
-                    m.chat.id, 
-                    str(out_path), 
-                    caption=f"✅ Metadata updated: `{meta_key}` set to `{meta_value}`"
+            async with track_job(uid, "meta edit", os.path.getsize(dl_path), status) as job:
+                # 1. Update metadata (This is usually very fast)
+                await status.edit_text(f"🔧 **Applying new metadata tag...**")
+                job.stage("tagging")
+                src = await probe_input(dl_path)
+                success = await run_stage(
+                    "metadata",
+                    lambda: update_metadata(str(dl_path), str(out_path), meta_key, meta_value),
+                    lambda _: verify_output(out_path, probe_duration(src), stream_kinds(src))
                 )
-                await status.delete()
-            else:
-                await status.edit_text("❌ Metadata update failed.")
+
+                if success:
+                    # 2. Upload the new file
+                    await status.edit_text(f"📤 **Uploading edited file...**")
+                    job.stage("uploading")
+                    await c.send_document(
+                        m.chat.id, 
+                        str(out_path), 
+                        caption=f"✅ Metadata updated: `{meta_key}` set to `{meta_value}`",
+                        progress=job.progress
+                    )
+                    await status.delete()
+                else:
+                    await status.edit_text("❌ Metadata update failed.")
             
         except Exception as e:
             await status.edit_text(f"❌ Error during metadata processing: {e}")
@@ -708,24 +1602,37 @@ async def inputs(c, m):
                 del USER_STATE[uid]
 
 @app.on_message(filters.photo & filters.private)
+@admission(step_cost("wait_thumb"))
 async def photo_handler(c, m):
     uid = m.from_user.id
     if uid in USER_STATE and USER_STATE[uid]["action"] == "wait_thumb":
+        vid_msg = USER_STATE[uid]["msg"]
+        USER_STATE[uid] = {"action": "applying_thumb"}
         status = await m.reply_text("🖼 **Applying...**")
-        vid_msg = USER_STATE[uid]["msg"] 
         vid = WORKDIR / f"v_{uid}.mp4"
         th = WORKDIR / f"t_{uid}.jpg"
         
         try:
-            await asyncio.gather(vid_msg.download(str(vid)), m.download(str(th)))
-            
-            await c.send_video(m.chat.id, str(vid), thumb=str(th), caption="**New Thumbnail Applied!**")
-            await status.delete()
-        
+            async with track_job(uid, "thumbnail", media_size(vid_msg), status) as job:
+                job.stage("downloading")
+                await asyncio.gather(download_verified(c, vid_msg, vid, job.progress), m.download(str(th)))
+                
+                job.stage("uploading")
+                await c.send_video(m.chat.id, str(vid), thumb=str(th), caption="**New Thumbnail Applied!**", progress=job.progress)
+                await status.delete()
+        except Draining:
+            await status.edit(DRAIN_TEXT)
         finally:
             if vid.exists(): os.remove(vid)
             if th.exists(): os.remove(th)
-            del USER_STATE[uid]
+            USER_STATE.pop(uid, None)
+
+async def main():
+    await app.start()
+    ops = asyncio.create_task(ops_loop())
+    await idle()
+    ops.cancel()
+    await app.stop()
 
 if __name__ == "__main__":
     # --- STARTUP CLEANUP ---
@@ -736,7 +1643,8 @@ if __name__ == "__main__":
     
     WORKDIR.mkdir(exist_ok=True)
     logger.info(f"📂 Work directory created/recreated: {WORKDIR}")
+    botstate.reset()
     # -----------------------
     
     logger.info("🚀 Bot Started with your credentials.")
-    app.run()
+    app.run(main())